@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from datetime import datetime, timedelta
 import os
+from collections import Counter
 
 # Internal modules
 import database as db
@@ -52,19 +53,26 @@ currency = db.get_setting("currency_symbol")
 store_name = db.get_setting("store_name")
 
 # --- HELPER FUNCTIONS ---
-def refresh_trie():
-    conn = db.get_connection()
-    df = pd.read_sql("SELECT * FROM products", conn)
-    conn.close()
+@st.cache_resource(show_spinner=False, max_entries=1)
+def refresh_trie(products_version):
+    # products_version is only the cache key: any product/stock change bumps it,
+    # so reruns reuse the built trie until the catalog actually changes.
+    # cache_resource hands back the same objects instead of unpickling a copy
+    # per rerun; callers only read them (cart rows are never modified in place).
+    # No images here; the POS grid fetches pictures for the visible cards only
+    df = db.get_all_products()
     t = utils.Trie()
     for _, row in df.iterrows():
         t.insert(row['name'], row.to_dict())
-    return t, df
+    # Lower-cased names for the linear search, built once per catalog version
+    names_lc = np.char.lower(df['name'].to_numpy(dtype=str))
+    return t, df, names_lc
 
-if 'product_trie' not in st.session_state:
-    trie, df_p = refresh_trie()
-    st.session_state['product_trie'] = trie
-    st.session_state['df_products'] = df_p
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_upi_qr(upi_id, name, total, txn_ref):
+    # The UPI screen reruns every second for its countdown; the QR for the
+    # same amount/reference is encoded once and reused
+    return utils.generate_upi_qr(upi_id, name, total, txn_ref)
 
 # --- AUTHENTICATION MODULE ---
 def login_view():
@@ -76,10 +84,10 @@ def login_view():
         st.caption("Live Terminal Availability")
         
         # Use new status function to show real-time locks
-        terminals = db.get_all_terminals_status()
+        terminals = db.get_terminal_status_rows()
         
-        for index, row in terminals.iterrows():
-            is_locked = pd.notna(row['current_user']) and row['current_user'] != ''
+        for row in terminals:
+            is_locked = bool(row['current_user'])
             
             if row['status'] == 'Active':
                 if is_locked:
@@ -160,12 +168,7 @@ def login_view():
                     st.warning("Please choose a different terminal or wait until it is released.")
                     return
 
-                h = utils.generate_hash(pass_in)
-                conn = db.get_connection()
-                c = conn.cursor()
-                c.execute("SELECT role, full_name FROM users WHERE username=? AND password_hash=?", (user_in, h))
-                res = c.fetchone()
-                conn.close()
+                res = db.authenticate_user(user_in, pass_in)
                 
                 if res:
                     role, fname = res
@@ -217,13 +220,14 @@ def pos_interface():
         st.markdown(f"<div style='text-align:right'><b>{st.session_state['full_name']}</b><br><span style='font-size:0.8em;opacity:0.7'>Operator</span></div>", unsafe_allow_html=True)
     st.markdown("</div>", unsafe_allow_html=True)
         
-    trie, df_p = refresh_trie()
+    trie, df_p, names_lc = refresh_trie(db.get_products_version())
     
     # FEATURE 8: FLASH SALE TIMER
-    active_campaigns = db.get_active_campaigns()
-    flash_sales = active_campaigns[active_campaigns['type'] == 'Flash Sale']
-    if not flash_sales.empty:
-        fs = flash_sales.iloc[0]
+    active_campaigns = db.get_active_campaign_rows()
+    flash_sales = [c for c in active_campaigns if c['type'] == 'Flash Sale']
+    festival_active = any(c['type'] == 'Festival Offer' for c in active_campaigns)
+    if flash_sales:
+        fs = flash_sales[0]
         end_time = datetime.strptime(fs['end_time'], "%Y-%m-%d %H:%M:%S")
         remaining = end_time - utils.get_system_time()
         if remaining.total_seconds() > 0:
@@ -342,16 +346,24 @@ def pos_interface():
             if st.button("🎥 Start Live Scanner", disabled=True, help="Disabled for exam deployment"):
                  st.warning("Camera scanning disabled for exam-ready deployment.")
 
+            # Units of each product already in the cart, counted once per render
+            cart_counts = Counter(x['id'] for x in st.session_state['cart'])
+
+            # Parse + look up only when the scan field changes; the text input keeps
+            # its value across reruns, which used to re-query (and re-add) every time
             scanned_pid = None
-            if qr_input:
+            if not qr_input:
+                st.session_state.pop('last_qr', None)
+            elif qr_input != st.session_state.get('last_qr'):
+                st.session_state['last_qr'] = qr_input
                 scanned_pid = utils.parse_qr_input(qr_input)
 
             if scanned_pid:
                 prod = db.get_product_by_id(scanned_pid)
                 if prod:
-                    cart_qty = sum(1 for x in st.session_state['cart'] if x['id'] == scanned_pid)
-                    if prod['stock'] > cart_qty:
+                    if prod['stock'] > cart_counts[scanned_pid]:
                         st.session_state['cart'].append(prod)
+                        cart_counts[scanned_pid] += 1
                         st.markdown(utils.get_sound_html('success'), unsafe_allow_html=True)
                         st.toast(f"Scanned: {prod['name']}")
                     else:
@@ -376,31 +388,37 @@ def pos_interface():
         left_panel, right_panel = st.columns([2, 1])
 
         with left_panel:
-            results = []
+            # Trie hits are already dicts; DataFrame matches are only turned
+            # into dicts for the page being shown
+            results = None
+            matches = df_p
             if query:
                 if algo.startswith("Trie"):
                     results = trie.search_prefix(query)
                 else:
-                    results = df_p[df_p['name'].str.contains(query, case=False)].to_dict('records')
-            else:
-                results = df_p.to_dict('records')
+                    # Plain substring test over the cached lower-case names (no regex per keystroke)
+                    matches = df_p[np.char.find(names_lc, query.lower()) >= 0]
             
             page_size = 6
             if 'page' not in st.session_state: st.session_state.page = 0
             start_idx = st.session_state.page * page_size
             end_idx = start_idx + page_size
-            visible_items = results[start_idx:end_idx]
+            if results is not None:
+                n_results = len(results)
+                visible_items = results[start_idx:end_idx]
+            else:
+                n_results = len(matches)
+                visible_items = matches.iloc[start_idx:end_idx].to_dict('records')
+            images = db.get_product_images(item['id'] for item in visible_items)
             
             cols = st.columns(3)
             for i, item in enumerate(visible_items):
                 with cols[i % 3]:
                     st.markdown(styles.product_card_html(
-                        item['name'], item['price'], item['stock'], item['category'], currency, item.get('image_data')
+                        item['name'], item['price'], item['stock'], item['category'], currency, images.get(item['id'])
                     ), unsafe_allow_html=True)
                     
-                    cart_qty = sum(1 for x in st.session_state['cart'] if x['id'] == item['id'])
-                    
-                    if item['stock'] > cart_qty:
+                    if item['stock'] > cart_counts[item['id']]:
                         if st.button("Add ➕", key=f"add_{item['id']}"):
                             st.session_state['cart'].append(item)
                             st.markdown(utils.get_sound_html('click'), unsafe_allow_html=True)
@@ -413,7 +431,7 @@ def pos_interface():
             if c_prev.button("Previous") and st.session_state.page > 0:
                 st.session_state.page -= 1
                 st.rerun()
-            if c_next.button("Next") and end_idx < len(results):
+            if c_next.button("Next") and end_idx < n_results:
                 st.session_state.page += 1
                 st.rerun()
 
@@ -421,8 +439,13 @@ def pos_interface():
             st.markdown("<div class='card-container'>", unsafe_allow_html=True)
             st.markdown("### 🛍️ Cart Summary")
             if st.session_state['cart']:
-                cart_df = pd.DataFrame(st.session_state['cart'])
-                summary = cart_df.groupby('name').agg({'price': 'first', 'id': 'count'}).rename(columns={'id': 'Qty'})
+                # One summary row per product straight from the counts, no groupby
+                first_seen = {}
+                for x in st.session_state['cart']:
+                    first_seen.setdefault(x['id'], x)
+                summary = pd.DataFrame({'price': [first_seen[pid]['price'] for pid in cart_counts],
+                                        'Qty': list(cart_counts.values())},
+                                       index=pd.Index([first_seen[pid]['name'] for pid in cart_counts], name='name'))
                 summary['Total'] = summary['price'] * summary['Qty']
                 st.dataframe(summary[['Qty', 'Total']], use_container_width=True)
                 
@@ -472,8 +495,7 @@ def pos_interface():
                     for msg in loss_msgs: st.caption(f"• {msg}")
 
                 fest_disc = 0
-                fest_sales = active_campaigns[active_campaigns['type'] == 'Festival Offer']
-                if not fest_sales.empty:
+                if festival_active:
                     fest_disc = raw_total * 0.05
                     st.caption(f"🎉 Festival Offer Applied (-{currency}{fest_disc:.2f})")
 
@@ -622,38 +644,15 @@ def pos_interface():
             if 'upi_txn_ref' not in st.session_state:
                 st.session_state['upi_txn_ref'] = f"INV-{random.randint(1000,9999)}"
             
-            remaining = int(st.session_state['qr_expiry'] - time.time())
-            
             c_qr, c_info = st.columns([1, 1])
             with c_qr:
                 upi_id = db.get_setting("upi_id")
                 txn_ref = st.session_state['upi_txn_ref']
-                qr_img = utils.generate_upi_qr(upi_id, store_name, total, txn_ref)
+                qr_img = cached_upi_qr(upi_id, store_name, total, txn_ref)
                 st.image(qr_img, width=250, caption=f"Scan to Pay: {currency}{total:.2f}")
             
             with c_info:
-                if remaining > 0:
-                    mins, secs = divmod(remaining, 60)
-                    style_cls = "timer-box-alert" if remaining < 30 else "timer-box-normal"
-                    st.markdown(f"<div class='{style_cls}'>Expires in: {mins:02d}:{secs:02d}</div>", unsafe_allow_html=True)
-                    
-                    st.markdown("### Verification (Demo)")
-                    upi_ref = st.text_input("Enter UPI Transaction ID (UT / Ref No)")
-                    if st.button("Verify & Print Bill"):
-                        if len(upi_ref) > 6:
-                            st.markdown(utils.get_sound_html('success'), unsafe_allow_html=True)
-                            finalize_sale(total, "UPI")
-                        else:
-                            st.markdown(utils.get_sound_html('error'), unsafe_allow_html=True)
-                            st.error("Invalid Transaction ID")
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    st.error("⏰ QR Code Expired")
-                    if st.button("🔄 Regenerate"):
-                        st.session_state['qr_expiry'] = None
-                        st.session_state.pop('upi_txn_ref', None)
-                        st.rerun()
+                upi_countdown(total)
 
         elif mode == 'Card':
             st.info("💳 Card Payment Simulation")
@@ -714,6 +713,34 @@ def pos_interface():
                 st.rerun()
         st.markdown("</div>", unsafe_allow_html=True)
 
+@st.fragment(run_every=1)
+def upi_countdown(total):
+    # Only this block reruns every second; the rest of the POS page (catalog,
+    # campaigns, QR image) stays as rendered until the operator acts
+    if st.session_state.get('qr_expiry') is None:
+        return
+    remaining = int(st.session_state['qr_expiry'] - time.time())
+    if remaining > 0:
+        mins, secs = divmod(remaining, 60)
+        style_cls = "timer-box-alert" if remaining < 30 else "timer-box-normal"
+        st.markdown(f"<div class='{style_cls}'>Expires in: {mins:02d}:{secs:02d}</div>", unsafe_allow_html=True)
+        
+        st.markdown("### Verification (Demo)")
+        upi_ref = st.text_input("Enter UPI Transaction ID (UT / Ref No)")
+        if st.button("Verify & Print Bill"):
+            if len(upi_ref) > 6:
+                st.markdown(utils.get_sound_html('success'), unsafe_allow_html=True)
+                finalize_sale(total, "UPI")
+            else:
+                st.markdown(utils.get_sound_html('error'), unsafe_allow_html=True)
+                st.error("Invalid Transaction ID")
+    else:
+        st.error("⏰ QR Code Expired")
+        if st.button("🔄 Regenerate"):
+            st.session_state['qr_expiry'] = None
+            st.session_state.pop('upi_txn_ref', None)
+            st.rerun()
+
 def finalize_sale(total, mode):
     # --- REAL-TIME SIMULATION FIX ---
     with st.spinner(f"Processing {mode} Transaction..."):
@@ -750,14 +777,13 @@ def finalize_sale(total, mode):
             calc['points'],
             points_earned,
             integrity_hash,
-            30 
+            30,
+            log=(operator, "Sale Completed", f"Sale #{{sale_id}} for {currency}{total:.2f}")
         )
         
         st.session_state['undo_stack'].append(sale_id)
         st.session_state['redo_stack'] = []
         
-        db.log_activity(operator, "Sale Completed", f"Sale #{sale_id} for {currency}{total:.2f}")
-        
         # FIX 9: GENERATE COUPON
         new_coupon_details = None
         if customer_mobile:
@@ -788,9 +814,7 @@ def inventory_manager():
     st.title("📦 Master Inventory Management")
     tab_view, tab_add, tab_restock, tab_reqs, tab_metrics, tab_abc = st.tabs(["View & Edit", "Add New Product", "➕ Restock (Manual/QR)", "📋 Stock Requests", "Stock Metrics", "ABC Analysis"])
     
-    conn = db.get_connection()
-    df = pd.read_sql("SELECT * FROM products", conn)
-    conn.close()
+    df = db.get_all_products()
     
     with tab_view:
         st.markdown("<div class='card-container'>", unsafe_allow_html=True)
@@ -801,7 +825,7 @@ def inventory_manager():
         search_txt = col_f2.text_input("Search Name")
         df_filtered = df
         if cat_filter != "All": df_filtered = df[df['category'] == cat_filter]
-        if search_txt: df_filtered = df_filtered[df_filtered['name'].str.contains(search_txt, case=False)]
+        if search_txt: df_filtered = df_filtered[df_filtered['name'].str.lower().str.contains(search_txt.lower(), regex=False)]
         
         st.dataframe(df_filtered[['id', 'name', 'category', 'price', 'stock', 'expiry_date', 'is_dead_stock']], use_container_width=True)
         
@@ -872,7 +896,10 @@ def inventory_manager():
         col_qr_re, col_man_re = st.columns(2)
         with col_qr_re:
             re_qr = st.text_input("Scan QR (PROD:ID)", key="restock_qr")
-            if re_qr:
+            if not re_qr:
+                st.session_state.pop('last_restock_qr', None)
+            elif re_qr != st.session_state.get('last_restock_qr'):
+                st.session_state['last_restock_qr'] = re_qr
                 pid = utils.parse_qr_input(re_qr)
                 if pid: st.session_state['restock_selected_id'] = pid
         with col_man_re:
@@ -912,11 +939,10 @@ def inventory_manager():
         st.dataframe(db.get_stock_requests(), use_container_width=True)
         
         # Admin Action for Requests
-        reqs = db.get_stock_requests()
-        pending = reqs[reqs['status'] == 'Pending']
-        if not pending.empty and st.session_state['role'] in ['Admin', 'Inventory Manager']:
+        pending = db.get_pending_stock_request_rows()
+        if pending and st.session_state['role'] in ['Admin', 'Inventory Manager']:
              st.markdown("#### Pending Actions")
-             for _, r in pending.iterrows():
+             for r in pending:
                 with st.expander(f"REQ #{r['id']}: {r['product_name']} ({r['quantity']})"):
                     st.write(f"**User:** {r['requested_by']} | **Note:** {r['notes']}")
                     c1, c2 = st.columns(2)
@@ -950,9 +976,7 @@ def analytics_dashboard():
     else:
         active_sales = df_sales
 
-    conn = db.get_connection()
-    df_prods = pd.read_sql("SELECT * FROM products", conn)
-    conn.close()
+    df_prods = db.get_all_products()
     
     try:
         active_sales['date'] = pd.to_datetime(active_sales['timestamp'], format='mixed', dayfirst=False, errors='coerce')
@@ -974,6 +998,7 @@ def analytics_dashboard():
         date_range = st.date_input("Select Date Range", value=(min_date, max_date), min_value=min_date, max_value=max_date)
     
     # Filter Data based on selection
+    start_d = end_d = None
     if isinstance(date_range, tuple) and len(date_range) == 2:
         start_d, end_d = date_range
         mask = (active_sales['date'].dt.date >= start_d) & (active_sales['date'].dt.date <= end_d)
@@ -1079,7 +1104,7 @@ def analytics_dashboard():
         c_trend1, c_trend2 = st.columns(2)
         
         # Use filtered sales for trends
-        daily = filtered_sales.groupby(filtered_sales['date'].dt.date)['total_amount'].sum().reset_index()
+        daily = db.get_daily_sales(start_d, end_d)
         trend_dir = utils.analyze_trend_slope(daily['total_amount'].values)
         st.info(f"Market Trend (Algo #32): {trend_dir}")
         
@@ -1105,12 +1130,8 @@ def analytics_dashboard():
         st.markdown("<div class='card-container'>", unsafe_allow_html=True)
         st.subheader("👥 Employee Efficiency & Performance")
         
-        # Aggregate manually from filtered data for accuracy
-        perf_stats = filtered_sales.groupby('operator').agg(
-            txn_count=('id', 'count'),
-            total_revenue=('total_amount', 'sum'),
-            avg_speed=('time_taken', 'mean')
-        ).reset_index()
+        # Aggregated in SQL over the same date range
+        perf_stats = db.get_sales_by_operator(start_d, end_d)
         
         if not perf_stats.empty:
             perf_stats['efficiency_score'] = (perf_stats['total_revenue'] * 0.001) + (perf_stats['txn_count'] * 2) - (perf_stats['avg_speed'] * 0.1)
@@ -1128,7 +1149,7 @@ def analytics_dashboard():
     with t5:
         st.markdown("<div class='card-container'>", unsafe_allow_html=True)
         if not filtered_sales.empty:
-            daily = filtered_sales.groupby(filtered_sales['date'].dt.date)['total_amount'].sum().reset_index()
+            daily = db.get_daily_sales(start_d, end_d)
             daily_vals = daily['total_amount'].values
             prediction = utils.forecast_next_period(daily_vals)
             c1, c2 = st.columns(2)
@@ -1147,9 +1168,7 @@ def analytics_dashboard():
         st.markdown("<div class='card-container'>", unsafe_allow_html=True)
         col_algo1, col_algo2 = st.columns(2)
         with col_algo1:
-            conn = db.get_connection()
-            all_prods = pd.read_sql("SELECT * FROM products", conn).to_dict('records')
-            conn.close()
+            all_prods = db.get_all_products().to_dict('records')
             search_key = "id"
             target_val = all_prods[-1]['id'] if all_prods else 0
             t0 = time.perf_counter()
@@ -1166,9 +1185,7 @@ def analytics_dashboard():
             })
             st.table(bench_df)
         with col_algo2:
-            conn = db.get_connection()
-            df_p = pd.read_sql("SELECT * FROM products", conn)
-            conn.close()
+            df_p = db.get_all_products()
             rank_df = utils.rank_products(filtered_sales, df_p)
             if not rank_df.empty: st.dataframe(rank_df[['rank', 'name', 'qty_sold', 'score']], hide_index=True)
             else: st.info("No sales data for ranking.")
@@ -1179,30 +1196,19 @@ def analytics_dashboard():
         c1, c2 = st.columns(2)
         with c1:
             st.markdown("#### 🏆 Best POS Operators")
-            staff_rank = filtered_sales.groupby('operator')['total_amount'].sum().reset_index().sort_values('total_amount', ascending=False)
+            op_stats = db.get_sales_by_operator(start_d, end_d)
+            staff_rank = op_stats[['operator', 'total_revenue']].rename(columns={'total_revenue': 'total_amount'}).sort_values('total_amount', ascending=False)
             st.dataframe(staff_rank.style.highlight_max(axis=0), use_container_width=True)
         with c2:
             st.markdown("#### ⚡ Fastest Checkouts")
-            fast_op = filtered_sales.groupby('operator')['time_taken'].mean().reset_index().sort_values('time_taken')
+            fast_op = op_stats[['operator', 'avg_speed']].rename(columns={'avg_speed': 'time_taken'}).sort_values('time_taken')
             st.dataframe(fast_op, use_container_width=True)
         st.markdown("</div>", unsafe_allow_html=True)
     with t8:
         st.markdown("<div class='card-container'>", unsafe_allow_html=True)
         st.subheader("📊 Category Performance Analysis")
-        # Recalculate category performance based on filtered sales
-        cat_perf_df = pd.DataFrame()
-        if not filtered_sales.empty:
-            cat_sales = {}
-            prod_cat_map = df_prods.set_index('id')['category'].to_dict()
-            for _, row in filtered_sales.iterrows():
-                try:
-                    item_ids = json.loads(row['items_json'])
-                    for iid in item_ids:
-                        cat = prod_cat_map.get(iid, "Unknown")
-                        share = row['total_amount'] / len(item_ids) 
-                        cat_sales[cat] = cat_sales.get(cat, 0) + share
-                except: continue
-            cat_perf_df = pd.DataFrame(list(cat_sales.items()), columns=['Category', 'Revenue']).sort_values('Revenue', ascending=False)
+        # Category performance for the selected date range, grouped in SQL
+        cat_perf_df = db.get_category_performance(start_d, end_d)
 
         if not cat_perf_df.empty:
             c1, c2 = st.columns([2, 1])
@@ -1401,10 +1407,10 @@ def admin_panel():
                         else: st.error("Error creating terminal")
             
             # --- FIX: USE STATUS-AWARE DATAFRAME FOR ADMIN CONTROL ---
-            terms_status = db.get_all_terminals_status()
+            terms_status = db.get_terminal_status_rows()
             stats_df = db.get_terminal_stats()
             
-            for _, t in terms_status.iterrows():
+            for t in terms_status:
                 with st.container():
                     c1, c2, c3 = st.columns([3, 1, 1])
                     
@@ -1418,14 +1424,14 @@ def admin_panel():
                     
                     # VISUAL STATUS
                     stat_icon = "🟢" if t['status'] == 'Active' else "🔴"
-                    if pd.notna(t['current_user']) and t['current_user'] != '':
+                    if t['current_user']:
                         stat_icon = "🟡" # In Use
                     
                     c1.write(f"{stat_icon} **{t['name']}** ({t['id']}) - {t['location']}")
                     c1.caption(f"Orders: {cnt} | Revenue: {currency}{rev:,.2f}")
                     
                     # Show active session details if locked
-                    if pd.notna(t['current_user']) and t['current_user'] != '':
+                    if t['current_user']:
                          c1.warning(f"🔒 Locked by **{t['current_user']}** since {t['login_time']}")
                          if c1.button(f"🔓 Force Unlock {t['id']}", key=f"unlock_{t['id']}"):
                              db.force_unlock_terminal(t['id'])
@@ -1467,8 +1473,7 @@ def admin_panel():
                         else: st.error("Error creating user")
             
             st.subheader("Manage User Status")
-            users = db.get_all_users()
-            for _, u in users.iterrows():
+            for u in db.get_user_rows():
                 with st.container():
                     c1, c2 = st.columns([4, 1])
                     c1.write(f"**{u['username']}** ({u['role']}) - {u['status']}")
@@ -1485,11 +1490,10 @@ def admin_panel():
 
     with tab_req_app:
         st.markdown("<div class='card-container'>", unsafe_allow_html=True)
-        reqs = db.get_stock_requests()
-        pending = reqs[reqs['status'] == 'Pending']
-        if not pending.empty and st.session_state['role'] in ['Admin', 'Inventory Manager']:
+        pending = db.get_pending_stock_request_rows()
+        if pending and st.session_state['role'] in ['Admin', 'Inventory Manager']:
              st.markdown("#### Pending Actions")
-             for _, r in pending.iterrows():
+             for r in pending:
                 with st.expander(f"REQ #{r['id']}: {r['product_name']} ({r['quantity']})"):
                     st.write(f"**User:** {r['requested_by']} | **Note:** {r['notes']}")
                     c1, c2 = st.columns(2)
@@ -1498,7 +1502,7 @@ def admin_panel():
                     if c2.button("❌ Reject", key=f"rej_{r['id']}"):
                          db.update_request_status(r['id'], "Rejected"); st.rerun()
 
-        st.dataframe(reqs, use_container_width=True)
+        st.dataframe(db.get_stock_requests(), use_container_width=True)
         st.markdown("</div>", unsafe_allow_html=True)
 
     with tab_market:
@@ -1603,6 +1607,8 @@ def admin_panel():
         if f_date: filters['date'] = f_date
         
         txns = db.get_transaction_history(filters)
+        if len(txns) == db.HISTORY_PAGE_SIZE:
+            st.caption(f"Showing the latest {db.HISTORY_PAGE_SIZE} matching bills. Use the filters to narrow down.")
         if not txns.empty:
             st.dataframe(
                 txns[['id', 'timestamp', 'total_amount', 'status', 'payment_mode', 'operator', 'pos_id', 'customer_mobile', 'integrity_hash']], 
@@ -1634,6 +1640,8 @@ def admin_panel():
             
             st.markdown("---")
             st.markdown("#### All System Logs")
+            if len(logs) == db.HISTORY_PAGE_SIZE:
+                st.caption(f"Showing the latest {db.HISTORY_PAGE_SIZE} entries.")
             st.dataframe(logs, use_container_width=True)
         else:
             # Operator view: Filter out cancellation details if sensitive, or just show general
@@ -1679,6 +1687,12 @@ def main():
     if not st.session_state.get('user'):
         login_view()
     else:
+        # Keep this user's terminal lock from going stale; once a minute is
+        # plenty, not on every widget interaction
+        now = time.time()
+        if now - st.session_state.get('last_heartbeat', 0) >= db.SESSION_HEARTBEAT_INTERVAL:
+            db.touch_session(st.session_state['user'])
+            st.session_state['last_heartbeat'] = now
         with st.sidebar:
             st.markdown(f"""
             <div style="padding: 15px; background: rgba(255,255,255,0.05); border-radius: 12px; margin-bottom: 20px; border: 1px solid rgba(255,255,255,0.1);">
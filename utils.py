@@ -28,6 +28,13 @@ try:
 except (ImportError, OSError):
     qr_decode = None
 
+# --- OPTIONAL FAST JSON (items_json parsing in the analytics loops) ---
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # --- CONDITIONAL IMPORT FOR TKINTER ---
 try:
     import tkinter as tk
@@ -377,9 +384,6 @@ def get_sound_html(sound_type):
     </audio>
     """
 
-def generate_hash(data_string):
-    return hashlib.sha256(data_string.encode()).hexdigest()
-
 def generate_integrity_hash(txn_data):
     raw_string = f"{txn_data[0]}|{txn_data[1]}|{txn_data[2]}|{txn_data[3]}"
     return hashlib.sha256(raw_string.encode()).hexdigest()
@@ -546,11 +550,10 @@ def rank_products(df_sales, df_products):
     else:
         active_sales = df_sales
 
-    import json
     all_items = []
     for _, row in active_sales.iterrows():
         try:
-            ids = json.loads(row['items_json'])
+            ids = json_loads(row['items_json'])
             all_items.extend(ids)
         except: continue
         
@@ -610,7 +613,7 @@ def calculate_profit_loss(df_sales, df_products):
 
     for _, row in active_sales.iterrows():
         try:
-            items = json.loads(row['items_json'])
+            items = json_loads(row['items_json'])
             for pid in items:
                 if pid in prod_map:
                     p = prod_map[pid]
@@ -717,11 +720,11 @@ def calculate_financial_ratios(df_sales, df_products):
         active_sales = df_sales
 
     cogs = 0
-    prod_cp_map = df_products.set_index('id')['cost_price'].to_dict()
+    prod_cp_map = dict(zip(df_products['id'].tolist(), df_products['cost_price'].tolist()))
     
     for _, row in active_sales.iterrows():
         try:
-            items = json.loads(row['items_json'])
+            items = json_loads(row['items_json'])
             for pid in items:
                 cogs += prod_cp_map.get(pid, 0)
         except: continue